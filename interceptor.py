@@ -1,16 +1,54 @@
 import argparse
+import functools
+import importlib.util
 import json
 import re
-import requests
-from flask import Flask, request, Response
+import sys
+import orjson
+import urllib3
+from dataclasses import dataclass
+from types import MappingProxyType
+from flask import Flask, abort, request, Response
 
 app = Flask(__name__)
 
+# ============================================================================
+# Pattern Matching
+# ============================================================================
+# Alias patterns and prompt tags are both "first entry in a priority list that
+# occurs anywhere in the text". Each list compiles to one regex with a group
+# per pattern inside a lookahead, so overlapping occurrences are all seen in a
+# single C-level pass and match.lastindex - 1 is the pattern's priority.
+
+def compile_priority_matcher(patterns, flags=0):
+    """Compile literal patterns (highest priority first) into one matcher."""
+    return re.compile(
+        "(?=" + "|".join(f"({re.escape(pattern)})" for pattern in patterns) + ")",
+        flags
+    )
+
+
+def find_best_match(matcher, text):
+    """
+    Scan text once with a priority matcher.
+    
+    Returns:
+        int: Index of the highest-priority pattern found, or None if none occur
+    """
+    best = None
+    for match in matcher.finditer(text):
+        priority = match.lastindex - 1
+        if best is None or priority < best:
+            best = priority
+            if best == 0:
+                break
+    return best
+
 # ============================================================================
 # CONFIGURATION: Model Alias Mapping
 # ============================================================================
 # Maps model name patterns (case-insensitive) to command tags
-MODEL_ALIAS_MAP = {
+MODEL_ALIAS_MAP = MappingProxyType({
     # Non-thinking patterns -> /no_thinking
     "nonthinking": "/no_thinking",
     "no_thinking": "/no_thinking",
@@ -27,7 +65,12 @@ MODEL_ALIAS_MAP = {
     "thinking": "/thinking",
     "reasoning": "/thinking",
     "think": "/thinking",
-}
+})
+
+# Earlier entries in MODEL_ALIAS_MAP win. Case folding happens inside the
+# matcher, so the model name is never copied through str.lower().
+_ALIAS_PATTERNS = tuple(MODEL_ALIAS_MAP)
+_ALIAS_RE = compile_priority_matcher(_ALIAS_PATTERNS, re.IGNORECASE)
 
 # ============================================================================
 # CONFIGURATION: Mode Parameters
@@ -83,6 +126,40 @@ MODE_PARAMS = {
     }
 }
 
+# The tables are shared by every request, so expose them read-only: a stray
+# write through a returned params dict can no longer leak into later requests.
+MODE_PARAMS = MappingProxyType({
+    command: MappingProxyType({**info, "params": MappingProxyType(info["params"])})
+    for command, info in MODE_PARAMS.items()
+})
+
+
+@dataclass(frozen=True)
+class Mode:
+    """A resolved MODE_PARAMS entry, with its params pre-rendered for logging."""
+    __slots__ = ("mode_name", "source", "params", "params_json")
+    mode_name: str
+    source: str
+    params: MappingProxyType
+    params_json: str
+
+
+# Built once from MODE_PARAMS; the request path only does attribute reads
+_MODES = {
+    command: Mode(
+        mode_name=info["mode_name"],
+        source=info["source"],
+        params=info["params"],
+        params_json=json.dumps(dict(info["params"]), indent=2)
+    )
+    for command, info in MODE_PARAMS.items()
+}
+_DEFAULT_MODE = _MODES["default"]
+
+# Explicit system prompt tags, highest priority first (case-sensitive)
+PROMPT_TAGS = ("/no_thinking", "/precise", "/thinking")
+_PROMPT_RE = compile_priority_matcher(PROMPT_TAGS)
+
 # ============================================================================
 # Mode Detection Functions
 # ============================================================================
@@ -95,18 +172,24 @@ def detect_mode_from_alias(model_name):
         model_name: The model field from the request (e.g., "openai/Qwen3.5-NonThinking")
     
     Returns:
-        tuple: (command, mode_info_dict) or (None, None) if no match
+        tuple: (command, Mode) or (None, None) if no match
     """
     if not model_name:
         return None, None
     
-    model_lower = model_name.lower()
-    
-    for pattern, command in MODEL_ALIAS_MAP.items():
-        if pattern in model_lower:
-            return command, MODE_PARAMS.get(command, MODE_PARAMS["default"])
+    command = _alias_command(model_name)
+    if command is None:
+        return None, None
     
-    return None, None
+    return command, _MODES.get(command, _DEFAULT_MODE)
+
+
+@functools.lru_cache(maxsize=1024)
+def _alias_command(model_name):
+    # Clients reuse a handful of model names, so after warm-up this is a
+    # cache hit and the name is never rescanned.
+    best = find_best_match(_ALIAS_RE, model_name)
+    return None if best is None else MODEL_ALIAS_MAP[_ALIAS_PATTERNS[best]]
 
 
 def detect_mode_from_prompt(system_content):
@@ -117,44 +200,65 @@ def detect_mode_from_prompt(system_content):
         system_content: The content of the system message
     
     Returns:
-        tuple: (command, mode_info_dict) or (None, None) if no match
+        tuple: (command, Mode) or (None, None) if no match
     """
-    if not system_content:
+    if not system_content or not isinstance(system_content, str):
         return None, None
     
-    # Check for explicit tags in priority order
-    if "/no_thinking" in system_content:
-        return "/no_thinking", MODE_PARAMS["/no_thinking"]
-    elif "/precise" in system_content:
-        return "/precise", MODE_PARAMS["/precise"]
-    elif "/thinking" in system_content:
-        return "/thinking", MODE_PARAMS["/thinking"]
+    # Fast path: tags almost always lead the prompt. A leading tag decides the
+    # mode unless a higher-priority tag also appears somewhere else.
+    head = system_content[:64].lstrip()
+    if head.startswith(PROMPT_TAGS):
+        for priority, tag in enumerate(PROMPT_TAGS):
+            if head.startswith(tag):
+                if not any(higher in system_content for higher in PROMPT_TAGS[:priority]):
+                    return tag, _MODES[tag]
+                break
+    
+    # Single scan for all tags, keeping the highest-priority one found
+    best = find_best_match(_PROMPT_RE, system_content)
+    if best is None:
+        return None, None
     
-    return None, None
+    command = PROMPT_TAGS[best]
+    return command, _MODES[command]
 
 
-def inject_command_into_system_prompt(data, command):
+def find_system_message(messages):
+    """
+    Locate the first system message in a single pass.
+    
+    Args:
+        messages: The "messages" list from the request data
+    
+    Returns:
+        tuple: (index, content) or (-1, "") if there is no system message
+    """
+    for i, msg in enumerate(messages):
+        if msg.get("role") == "system":
+            return i, msg.get("content") or ""
+    return -1, ""
+
+
+def inject_command_into_system_prompt(data, command, sys_idx, sys_content):
     """
     Inject a command tag into the system prompt if not already present.
     
     Args:
         data: The request data dict with "messages" list
         command: The command to inject (e.g., "/no_thinking")
+        sys_idx: Index of the system message from find_system_message (-1 if none)
+        sys_content: Content of that system message
     
     Returns:
         bool: True if injection was performed, False otherwise
     """
-    messages = data.get("messages", [])
-    
-    # Find system message
-    for i, msg in enumerate(messages):
-        if msg.get("role") == "system":
-            content = msg.get("content", "")
-            # Only inject if command is not already at the start
-            if not content.strip().startswith(command):
-                data["messages"][i]["content"] = f"{command} {content}"
-                return True
-            return False
+    if sys_idx >= 0:
+        # Only inject if command is not already at the start
+        if not sys_content.strip().startswith(command):
+            data["messages"][sys_idx]["content"] = f"{command} {sys_content}"
+            return True
+        return False
     
     # No system message found, create one
     data["messages"].insert(0, {
@@ -173,83 +277,58 @@ def get_mode_and_params(data, trigger_mode):
         trigger_mode: One of "alias", "prompt", "any"
     
     Returns:
-        tuple: (mode_name, params, source_info)
-            - mode_name: Human-readable mode name
-            - params: Sampling parameters dict
+        tuple: (mode, source_info)
+            - mode: The resolved Mode (mode_name, params, params_json)
             - source_info: Dict with 'source' (alias/prompt/default) and 'command'
     """
-    messages = data.get("messages", [])
-    system_content = next(
-        (msg.get("content", "") for msg in messages if msg.get("role") == "system"),
-        ""
-    )
+    sys_idx, system_content = find_system_message(data.get("messages", []))
     model_name = data.get("model", "")
     
     alias_command = None
-    alias_mode_info = None
+    alias_mode = None
     prompt_command = None
-    prompt_mode_info = None
+    prompt_mode = None
     
     # Always detect both for 'any' mode, or the specific one requested
     if trigger_mode in ("alias", "any"):
-        alias_command, alias_mode_info = detect_mode_from_alias(model_name)
+        alias_command, alias_mode = detect_mode_from_alias(model_name)
     
     if trigger_mode in ("prompt", "any"):
-        prompt_command, prompt_mode_info = detect_mode_from_prompt(system_content)
+        prompt_command, prompt_mode = detect_mode_from_prompt(system_content)
     
     # Determine final mode based on trigger_mode
     if trigger_mode == "alias":
         # Alias only: use alias detection, inject command into prompt
         if alias_command:
-            inject_command_into_system_prompt(data, alias_command)
-            return (
-                alias_mode_info["mode_name"],
-                alias_mode_info["params"],
-                {"source": "alias", "command": alias_command, "model": model_name}
-            )
+            inject_command_into_system_prompt(data, alias_command, sys_idx, system_content)
+            return alias_mode, {"source": "alias", "command": alias_command, "model": model_name}
         # No alias match, use default
-        default = MODE_PARAMS["default"]
-        return default["mode_name"], default["params"], {"source": "default", "command": None}
+        return _DEFAULT_MODE, {"source": "default", "command": None}
     
     elif trigger_mode == "prompt":
         # Prompt only: use existing logic
         if prompt_command:
-            return (
-                prompt_mode_info["mode_name"],
-                prompt_mode_info["params"],
-                {"source": "prompt", "command": prompt_command}
-            )
+            return prompt_mode, {"source": "prompt", "command": prompt_command}
         # No prompt match, use default
-        default = MODE_PARAMS["default"]
-        return default["mode_name"], default["params"], {"source": "default", "command": None}
+        return _DEFAULT_MODE, {"source": "default", "command": None}
     
     elif trigger_mode == "any":
         # Any: Check alias first, then prompt. Prompt overrides alias.
         
         # If explicit prompt tag found, it always wins
         if prompt_command:
-            return (
-                prompt_mode_info["mode_name"],
-                prompt_mode_info["params"],
-                {"source": "prompt", "command": prompt_command}
-            )
+            return prompt_mode, {"source": "prompt", "command": prompt_command}
         
         # No explicit prompt tag, check alias
         if alias_command:
-            inject_command_into_system_prompt(data, alias_command)
-            return (
-                alias_mode_info["mode_name"],
-                alias_mode_info["params"],
-                {"source": "alias", "command": alias_command, "model": model_name}
-            )
+            inject_command_into_system_prompt(data, alias_command, sys_idx, system_content)
+            return alias_mode, {"source": "alias", "command": alias_command, "model": model_name}
         
         # Neither found, use default
-        default = MODE_PARAMS["default"]
-        return default["mode_name"], default["params"], {"source": "default", "command": None}
+        return _DEFAULT_MODE, {"source": "default", "command": None}
     
     # Fallback to default
-    default = MODE_PARAMS["default"]
-    return default["mode_name"], default["params"], {"source": "default", "command": None}
+    return _DEFAULT_MODE, {"source": "default", "command": None}
 
 
 # ============================================================================
@@ -292,6 +371,9 @@ EXAMPLES:
   # Any mode with custom ports
   python interceptor.py --trigger any --port 9000 --llm-port 8080 --verbose
 
+  # Production serving: 4 gunicorn worker processes, 8 threads each
+  python interceptor.py --workers 4 --threads 8
+
 For more information: https://github.com/yourusername/qwen-3.5-logic-shifter
 """
 
@@ -316,7 +398,23 @@ For more information: https://github.com/yourusername/qwen-3.5-logic-shifter
             "'any' checks both with prompt tags taking priority"
         )
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Serve with N gunicorn worker processes instead of Flask's built-in server (default: 0, built-in server)"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=8,
+        help="Threads per gunicorn worker; ignored without --workers (default: 8)"
+    )
+    args = parser.parse_args()
+    # gunicorn doesn't run on Windows; fail here rather than after the banner
+    if args.workers > 0 and (sys.platform == "win32" or importlib.util.find_spec("gunicorn") is None):
+        parser.error("--workers requires gunicorn (Linux/macOS)")
+    return args
 
 
 args = get_args()
@@ -324,38 +422,92 @@ args = get_args()
 # Config: Your llama-server destination
 LLAMA_SERVER_URL = f"http://{args.llm_host}:{args.llm_port}"
 
+# Per-request hot path reads these plain globals instead of args.* attributes
+_VERBOSE = args.verbose
+_TRIGGER = args.trigger
+_COMPLETIONS_URL = f"{LLAMA_SERVER_URL}/v1/chat/completions"
+
+# Upper bound per streamed read. Chunked SSE responses still yield each chunk
+# as soon as it arrives, so this only cuts per-read overhead on large bodies.
+_CHUNK_SIZE = 65536
+
+# Request headers (lowercased) that are not forwarded to llama-server. The body
+# is re-framed for the upstream hop (the chat body is re-encoded), so the
+# client's framing headers must not be copied across.
+_HOP_HEADERS = frozenset({"host", "content-length", "connection", "transfer-encoding"})
+
+# One connection pool for all upstream calls so keep-alive connections to
+# llama-server are reused across requests. urllib3 is used directly: it adds
+# no default headers, keeps no cookie jar, and skips requests' per-call
+# request preparation. Retries and redirects are off so the proxy stays a
+# transparent pipe.
+_POOL = urllib3.PoolManager(num_pools=4, maxsize=64, block=False, retries=False)
+
 
 # ============================================================================
 # Flask Routes
 # ============================================================================
 
+def forward_headers():
+    """Copy the incoming request headers, minus hop-by-hop and framing headers."""
+    return {k: v for k, v in request.headers.items() if k.lower() not in _HOP_HEADERS}
+
+
+def stdlib_json_body(data):
+    """Encode a request body with the stdlib, for values orjson can't re-emit."""
+    return json.dumps(data).encode()
+
+
+def release_upstream(resp):
+    """Close an upstream response early and return its pool slot."""
+    resp.close()
+    resp.release_conn()
+
+
 @app.route('/v1/chat/completions', methods=['POST'])
 def intercepted_chat():
-    data = request.json
+    raw = request.get_data()
+    encode = orjson.dumps
+    try:
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        # orjson is stricter than the stdlib: it rejects lone surrogate
+        # escapes and NaN/Infinity, which clients do send. Accept those via
+        # json and re-encode with it too, as orjson can't emit them unchanged.
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            abort(400)
+        encode = stdlib_json_body
     
     # Get mode and parameters based on trigger setting
-    mode_name, params, source_info = get_mode_and_params(data, args.trigger)
+    mode, source_info = get_mode_and_params(data, _TRIGGER)
     
-    # Apply parameters to request data
-    data.update(params)
+    # Apply parameters to request data. Every mode, including the default,
+    # overrides sampling params, so there is no untouched pass-through case and
+    # the body is always re-encoded below.
+    data.update(mode.params)
     
     # Verbose logging
-    if args.verbose:
-        model_name = request.json.get("model", "unknown")
+    if _VERBOSE:
         print(f"\n{'='*60}")
-        print(f">>> INTERCEPTED: {mode_name}")
-        print(f">>> Trigger Mode: {args.trigger}")
+        print(f">>> INTERCEPTED: {mode.mode_name}")
+        print(f">>> Trigger Mode: {_TRIGGER}")
         print(f">>> Source: {source_info['source']}")
         if source_info.get('command'):
             print(f">>> Command: {source_info['command']}")
         if source_info.get('model'):
             print(f">>> Model: {source_info['model']}")
-        print(f">>> Parameters applied: {json.dumps(params, indent=2)}")
+        print(f">>> Parameters applied: {mode.params_json}")
         print(f"{'='*60}")
     
-    headers = {k: v for k, v in request.headers if k.lower() != 'host'}
-    resp = requests.post(f"{LLAMA_SERVER_URL}/v1/chat/completions", json=data, headers=headers, stream=True)
-    return Response(resp.iter_content(chunk_size=1024), status=resp.status_code, content_type=resp.headers.get('Content-Type'))
+    headers = forward_headers()
+    headers["Content-Type"] = "application/json"
+    resp = _POOL.urlopen("POST", _COMPLETIONS_URL, body=encode(data), headers=headers, preload_content=False)
+    response = Response(resp.stream(_CHUNK_SIZE), status=resp.status, content_type=resp.headers.get('Content-Type'))
+    # Hand the upstream connection back as soon as the client goes away
+    response.call_on_close(functools.partial(release_upstream, resp))
+    return response
 
 
 @app.route('/', defaults={'path': ''})
@@ -363,25 +515,49 @@ def intercepted_chat():
 def catch_all(path):
     url = f"{LLAMA_SERVER_URL}/{path}"
     
-    if args.verbose:
+    if _VERBOSE:
         print(f"--- BRIDGE: {request.method} /{path}")
 
     # Forward the request exactly as it came in
-    resp = requests.request(
-        method=request.method,
-        url=url,
-        headers={k: v for k, v in request.headers if k.lower() != 'host'},
-        data=request.get_data(),
-        cookies=request.cookies,
-        allow_redirects=False,
-        stream=True
+    resp = _POOL.urlopen(
+        request.method,
+        url,
+        body=request.get_data() or None,
+        headers=forward_headers(),
+        redirect=False,
+        preload_content=False
     )
 
-    return Response(
-        resp.iter_content(chunk_size=1024),
-        status=resp.status_code,
+    response = Response(
+        resp.stream(_CHUNK_SIZE),
+        status=resp.status,
         content_type=resp.headers.get('Content-Type')
     )
+    response.call_on_close(functools.partial(release_upstream, resp))
+    return response
+
+
+def run_gunicorn(workers, threads):
+    """
+    Serve the app with gunicorn's threaded workers (Linux/macOS only).
+    
+    Arguments are already parsed here, so the workers fork from this process
+    and inherit the configured globals instead of re-reading sys.argv.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class InterceptorApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"0.0.0.0:{args.port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("threads", threads)
+            self.cfg.set("keepalive", 75)
+
+        def load(self):
+            return app
+
+    InterceptorApplication().run()
 
 
 if __name__ == '__main__':
@@ -393,4 +569,8 @@ if __name__ == '__main__':
         print("  Detecting modes from system prompt tags")
     elif args.trigger == "any":
         print("  Detecting from model name or prompt (prompt tags take priority)")
-    app.run(host='0.0.0.0', port=args.port, threaded=True)
+    if args.workers > 0:
+        print(f"  Serving with gunicorn: {args.workers} workers x {args.threads} threads")
+        run_gunicorn(args.workers, args.threads)
+    else:
+        app.run(host='0.0.0.0', port=args.port, threaded=True)
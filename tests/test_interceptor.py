@@ -2,160 +2,349 @@
 """Test script for Qwen 3.5 Logic Shifter Interceptor Service."""
 
 import argparse
-import json
-from openai import OpenAI
+import asyncio
+import functools
+import io
+import sys
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+import httpx
+import orjson
+from openai import AsyncOpenAI
+
+
+# System messages are shared across calls (never mutated), one per mode tag.
+# The mode tag goes after the invariant text, so every test shares the same
+# prompt prefix and llama-server's prefix cache can reuse it across modes
+# (the interceptor and chat template find tags anywhere in the prompt).
+# Cases marked tag_first keep the README's leading-tag form covered.
+SYSTEM_PROMPT = "You are a helpful assistant."
+_DEFAULT_SYSTEM = {"role": "system", "content": SYSTEM_PROMPT}
+_TAGGED_SYSTEM_CACHE = {}
+
+
+def system_message(system_tag, tag_first=False):
+    """Return the system message for a mode tag, or the untagged default.
+
+    The tag goes after the prompt unless tag_first=True, which puts it at the
+    beginning as documented in the README.
+    """
+    if not system_tag:
+        return _DEFAULT_SYSTEM
+    content = f"{system_tag} {SYSTEM_PROMPT}" if tag_first else f"{SYSTEM_PROMPT} {system_tag}"
+    return _TAGGED_SYSTEM_CACHE.setdefault(
+        (system_tag, tag_first), {"role": "system", "content": content}
+    )
 
 
-def create_client(base_url="http://localhost:8189/v1"):
-    """Create an OpenAI client pointing to the interceptor."""
-    return OpenAI(base_url=base_url, api_key="not-needed")
+def create_http_client(base_url="http://localhost:8189/v1", http2=False):
+    """Create the shared httpx client used for all requests to the interceptor.
+
+    It owns an explicit keep-alive pool so concurrent and back-to-back test
+    calls reuse warm connections instead of reconnecting per test. With
+    http2=True, concurrent requests are multiplexed over one connection when
+    the server negotiates HTTP/2 (https only; plain http stays on HTTP/1.1).
+    """
+    return httpx.AsyncClient(
+        base_url=base_url,
+        timeout=httpx.Timeout(600.0, connect=5.0),
+        # Pool settings must live on the transport: httpx ignores the client's
+        # limits= whenever an explicit transport is passed
+        transport=httpx.AsyncHTTPTransport(
+            retries=0,
+            http2=http2,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60.0)
+        )
+    )
 
 
-def test_mode(client, mode_name, system_tag, user_query, model_name="qwen3.5"):
-    """Test a specific mode and print results."""
-    print(f"\n{'='*60}")
-    print(f"Testing: {mode_name}")
-    print(f"Model: {model_name}")
-    if system_tag:
-        print(f"System Tag: {system_tag}")
-    print("-"*60)
+@dataclass(frozen=True)
+class InterceptorClient:
+    """The SDK and raw clients for one interceptor, plus its precomputed URLs."""
+    openai: AsyncOpenAI
+    http: httpx.AsyncClient
+    base_url: str
+    root_url: str  # base_url without the trailing /v1, for /version etc.
+
+
+def create_client(base_url="http://localhost:8189/v1", http2=False):
+    """Create an async OpenAI client pointing to the interceptor."""
+    http_client = create_http_client(base_url, http2=http2)
+    root_url = base_url.rstrip("/")
+    if root_url.endswith("/v1"):
+        root_url = root_url[:-len("/v1")]
+    return InterceptorClient(
+        openai=AsyncOpenAI(base_url=base_url, api_key="not-needed", http_client=http_client),
+        http=http_client,
+        base_url=base_url,
+        root_url=root_url
+    )
 
-    messages = []
-    
-    # Add system message with mode tag if provided
-    if system_tag:
-        messages.append({
-            "role": "system", 
-            "content": f"{system_tag} You are a helpful assistant."
-        })
-    else:
-        messages.append({
-            "role": "system", 
-            "content": "You are a helpful assistant."
-        })
 
-    # Add user query
-    messages.append({"role": "user", "content": user_query})
+# Tests take either an AsyncOpenAI client or, in --raw mode, the bare httpx
+# client. Raw mode posts orjson-encoded bytes and reads only the fields the
+# tests print, skipping the SDK's request building and response models.
+_JSON_HEADERS = {"Content-Type": "application/json"}
 
-    try:
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            stream=False  # Non-streaming for cleaner test output
-        )
 
-        content = response.choices[0].message.content
-        
-        print(f"\nResponse:\n{content}")
-        
-        # Check if thinking tokens appear in output (indicates mode may not be working)
-        has_thinking_tokens = "<think>" in content or "</think>" in content
-        print(f"\nThinking tokens detected: {has_thinking_tokens}")
+async def complete(client, model_name, messages, max_tokens=None):
+    """Send a non-streaming chat completion and return the message content."""
+    extra = {} if max_tokens is None else {"max_tokens": max_tokens}
+    if isinstance(client, httpx.AsyncClient):
+        body = orjson.dumps({"model": model_name, "messages": messages, "stream": False, **extra})
+        resp = await client.post("chat/completions", content=body, headers=_JSON_HEADERS)
+        resp.raise_for_status()
+        return orjson.loads(resp.content)["choices"][0]["message"]["content"]
 
-    except Exception as e:
-        print(f"Error: {e}")
+    response = await client.chat.completions.create(
+        model=model_name,
+        messages=messages,
+        stream=False,  # Non-streaming for cleaner test output
+        **extra
+    )
+    return response.choices[0].message.content
+
+
+async def stream_deltas(client, model_name, messages):
+    """Send a streaming chat completion and yield the non-empty content deltas."""
+    if isinstance(client, httpx.AsyncClient):
+        body = orjson.dumps({"model": model_name, "messages": messages, "stream": True})
+        async with client.stream("POST", "chat/completions", content=body, headers=_JSON_HEADERS) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                if line == "data: [DONE]":
+                    break
+                content_delta = orjson.loads(line[6:])["choices"][0]["delta"].get("content")
+                if content_delta:
+                    yield content_delta
+        return
+
+    response = await client.chat.completions.create(
+        model=model_name,
+        messages=messages,
+        stream=True  # Streaming enabled for this test
+    )
+    async for chunk in response:
+        content_delta = chunk.choices[0].delta.content
+        if content_delta:
+            yield content_delta
 
 
-def test_streaming_mode(client, mode_name, system_tag, user_query, model_name="qwen3.5"):
-    """Test a specific mode with streaming output."""
-    print(f"\n{'='*60}")
-    print(f"Testing Streaming: {mode_name}")
-    print(f"Model: {model_name}")
+async def test_mode(client, mode_name, system_tag, user_query, model_name="qwen3.5", out=sys.stdout, tag_first=False):
+    """Test a specific mode and print results."""
+    print(f"\n{'='*60}", file=out)
+    print(f"Testing: {mode_name}", file=out)
+    print(f"Model: {model_name}", file=out)
     if system_tag:
-        print(f"System Tag: {system_tag}")
-    print("-"*60)
+        print(f"System Tag: {system_tag}", file=out)
+    print("-"*60, file=out)
 
-    messages = [
-        {"role": "system", "content": f"{system_tag} You are a helpful assistant." if system_tag else "You are a helpful assistant."},
-        {"role": "user", "content": user_query}
-    ]
+    # System message (with mode tag if provided) plus the user query
+    messages = [system_message(system_tag, tag_first), {"role": "user", "content": user_query}]
 
     try:
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            stream=True  # Streaming enabled for this test
-        )
+        content = await complete(client, model_name, messages)
 
-        print("\nStreaming response:")
-        full_content = ""
-        
-        for chunk in response:
-            content_delta = chunk.choices[0].delta.content or ""
-            print(content_delta, end="", flush=True)
-            full_content += content_delta
-        
-        print()  # Newline after streaming completes
-
-    except Exception as e:
-        print(f"Error: {e}")
+        print(f"\nResponse:\n{content}", file=out)
 
+        # Check if thinking tokens appear in output (indicates mode may not be working)
+        has_thinking_tokens = "<think>" in content or "</think>" in content
+        print(f"\nThinking tokens detected: {has_thinking_tokens}", file=out)
 
-def test_precise_mode(client):
-    """Test precise mode for code generation."""
-    test_mode(
-        client=client, 
-        mode_name="Precise Mode (Code Generation)", 
-        system_tag="/precise", 
-        user_query="Write a Python function that calculates Fibonacci numbers efficiently using memoization."
-    )
+    except Exception as e:
+        print(f"Error: {e}", file=out)
 
 
-def test_alias_mode(client, alias_model="qwen3.5-nonthinking"):
-    """Test alias mode detection from model name."""
-    print(f"\n{'='*60}")
-    print(f"Testing Alias Mode Detection")
-    print(f"Model Name: {alias_model} (should trigger /no_thinking)")
-    print(f"{'='*60}")
-    
-    test_mode(
-        client=client,
-        mode_name="Alias Mode (Non-Thinking via Model Name)",
-        system_tag=None,  # No explicit tag
-        user_query="What is the capital of France?",
-        model_name=alias_model
-    )
+async def test_streaming_mode(client, mode_name, system_tag, user_query, model_name="qwen3.5", out=sys.stdout, collect=False, tag_first=False):
+    """Test a specific mode with streaming output.
 
+    Deltas are written straight to `out`. The full text is only accumulated
+    (and returned) when collect=True; otherwise this returns None.
+    """
+    print(f"\n{'='*60}", file=out)
+    print(f"Testing Streaming: {mode_name}", file=out)
+    print(f"Model: {model_name}", file=out)
+    if system_tag:
+        print(f"System Tag: {system_tag}", file=out)
+    print("-"*60, file=out)
 
-def test_alias_override(client):
-    """Test that prompt tags override alias detection."""
-    print(f"\n{'='*60}")
-    print(f"Testing Alias Override (Prompt should win)")
-    print(f"Model: qwen3.5-nonthinking with /precise tag")
-    print(f"{'='*60}")
-    
-    test_mode(
-        client=client,
-        mode_name="Alias Override Test (Prompt wins)",
-        system_tag="/precise",  # Explicit precise tag
-        user_query="Write a Python function to reverse a string.",
-        model_name="qwen3.5-nonthinking"  # Would trigger non-thinking, but prompt wins
-    )
+    messages = [system_message(system_tag, tag_first), {"role": "user", "content": user_query}]
 
+    try:
+        print("\nStreaming response:", file=out)
+        parts = []
+        # Bound once, outside the per-token loop. Output is flushed at most
+        # every 50 ms rather than once per token.
+        write = out.write
+        flush = out.flush
+        monotonic = time.monotonic
+        last_flush = monotonic()
+
+        async for content_delta in stream_deltas(client, model_name, messages):
+            write(content_delta)
+            if collect:
+                parts.append(content_delta)
+            now = monotonic()
+            if now - last_flush > 0.05:
+                flush()
+                last_flush = now
+
+        print(file=out, flush=True)  # Newline after streaming completes
+        return "".join(parts) if collect else None
 
-def run_all_tests():
-    """Run all test scenarios."""
-    
-    # Parse arguments
+    except Exception as e:
+        print(f"Error: {e}", file=out)
+
+
+async def warm_up(client, model_name="qwen3.5"):
+    """Send a one-token request so the model is loaded before the real cases run."""
+    await complete(client, model_name, [{"role": "user", "content": "ping"}], max_tokens=1)
+
+
+@dataclass(frozen=True)
+class Case:
+    """
+    One test scenario.
+
+    model=None means "use --alias-model". `suites` lists the runs that include
+    the case: "default", "streaming", or a --test-trigger value ("all" runs
+    the "any" cases). `intro`, if set, is printed as an extra header and may
+    reference {model}. tag_first=True puts the tag at the beginning of the
+    system prompt instead of the end.
+    """
+    name: str
+    tag: Optional[str]
+    query: str
+    suites: Tuple[str, ...]
+    model: Optional[str] = "qwen3.5"
+    streaming: bool = False
+    intro: Optional[str] = None
+    tag_first: bool = False
+
+
+_ALL_CASES = (
+    # Test 1: General Thinking Mode (Default)
+    Case("General Thinking Mode (Default)", None,
+         "Explain the concept of recursion in simple terms.", ("default",)),
+    # Test 2: Non-Thinking Fast Mode - Simple Q&A should be quick and direct
+    Case("Non-Thinking Fast Mode", "/no_thinking",
+         "What is the capital of France?", ("default",)),
+    # Test 3: Non-Thinking Fast Mode - Math question (should be direct)
+    Case("Non-Thinking Fast Mode (Math)", "/no_thinking",
+         "Calculate: 15 × 8 + 42 ÷ 7", ("default",)),
+    # Test 4: Precise Mode - Code generation should be accurate
+    Case("Precise Mode (Code Generation)", "/precise",
+         "Write a Python function that calculates Fibonacci numbers efficiently using memoization.",
+         ("default", "prompt"), tag_first=True),
+    # Test 5: General Thinking with creative prompt (should show reasoning)
+    Case("General Thinking Mode (Creative)", None,
+         "Design a simple algorithm to sort a list of numbers. Explain your approach.", ("default",)),
+    # Streaming variants
+    Case("General Thinking (Streaming)", None,
+         "Explain the concept of recursion in simple terms.", ("streaming",), streaming=True),
+    Case("Non-Thinking Fast Mode (Streaming)", "/no_thinking",
+         "What is 2 + 2?", ("streaming",), streaming=True),
+    # Trigger modes: alias detection from the model name (no explicit tag)
+    Case("Alias Mode (Non-Thinking via Model Name)", None,
+         "What is the capital of France?", ("alias", "any"), model=None,
+         intro="Testing Alias Mode Detection\nModel Name: {model} (should trigger /no_thinking)"),
+    # Trigger modes: explicit prompt tag must win over the alias in the model name
+    Case("Alias Override Test (Prompt wins)", "/precise",
+         "Write a Python function to reverse a string.", ("any",), model="qwen3.5-nonthinking",
+         intro="Testing Alias Override (Prompt should win)\nModel: {model} with /precise tag",
+         tag_first=True),
+    # Trigger modes: prompt tag only, at the beginning of the system prompt
+    Case("Prompt Mode - Non-Thinking", "/no_thinking",
+         "What is 2+2?", ("prompt", "any"), tag_first=True),
+)
+
+
+async def run_case(client, case, alias_model, out=sys.stdout):
+    """Run one Case through test_mode or test_streaming_mode."""
+    model_name = case.model or alias_model
+    if case.intro:
+        print(f"\n{'='*60}", file=out)
+        print(case.intro.format(model=model_name), file=out)
+        print(f"{'='*60}", file=out)
+
+    test = test_streaming_mode if case.streaming else test_mode
+    await test(client, case.name, case.tag, case.query, model_name=model_name, out=out,
+               tag_first=case.tag_first)
+
+
+async def _buffered(test, semaphore):
+    """Run one test with its output captured, so concurrent tests don't interleave."""
+    async with semaphore:
+        out = io.StringIO()
+        await test(out=out)
+        return out.getvalue()
+
+
+async def run_concurrently(tests, workers=4):
+    """
+    Run independent tests, at most `workers` at a time, printing each one's
+    output as it completes. With a single worker the tests run one by one
+    and write straight to stdout, so streaming output is shown live.
+    """
+    if workers <= 1:
+        for test in tests:
+            await test(out=sys.stdout)
+        return
+
+    semaphore = asyncio.Semaphore(workers)
+    for finished in asyncio.as_completed([_buffered(test, semaphore) for test in tests]):
+        sys.stdout.write(await finished)
+        sys.stdout.flush()
+
+
+def build_parser():
+    """Build the command line parser for the test suite."""
     parser = argparse.ArgumentParser(description="Test the Qwen 3.5 Logic Shifter Interceptor")
     parser.add_argument("--base-url", default="http://localhost:8189/v1", help="Interceptor base URL (default: http://localhost:8189/v1)")
     parser.add_argument("--streaming", action="store_true", help="Run streaming tests instead of non-streaming")
     parser.add_argument("--alias-model", default="qwen3.5-nonthinking", help="Model name for alias mode tests (default: qwen3.5-nonthinking)")
-    parser.add_argument("--test-trigger", type=str, choices=["alias", "prompt", "any", "all"], 
+    parser.add_argument("--test-trigger", type=str, choices=["alias", "prompt", "any", "all"],
                         help="Test specific trigger mode behavior")
-    args = parser.parse_args()
+    parser.add_argument("--http2", action="store_true",
+                        help="Multiplex requests over HTTP/2 when the server supports it, e.g. behind a TLS proxy "
+                             "(requires: pip install 'httpx[http2]')")
+    parser.add_argument("--raw", action="store_true",
+                        help="Post JSON directly with httpx instead of going through the OpenAI SDK")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Maximum number of tests in flight at once; 1 runs them in order with live output. --streaming always uses 1 (default: 4)")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false",
+                        help="Skip the one-token warm-up request sent before the tests")
+    return parser
+
+
+# Built once at import; main() only has to parse
+_PARSER = build_parser()
+
+
+async def run_all_tests(args):
+    """Run all test scenarios."""
+
+    # Create client with custom base URL if provided
+    tc = create_client(args.base_url, http2=args.http2)
+    client = tc.http if args.raw else tc.openai
+
+    # Check if interceptor is running first. The probe goes through the same
+    # pool the tests use, so the connection it opens is reused by the first
+    # test. Yielding once lets it begin connecting before the banner prints.
+    probe = asyncio.ensure_future(tc.http.head(tc.root_url + "/version", timeout=2.0))
+    await asyncio.sleep(0)
 
     print("="*60)
     print("Qwen 3.5 Logic Shifter - Interceptor Test Suite")
     print("="*60)
-    
-    # Check if interceptor is running first
+
     try:
-        import requests as req_lib
-        
-        resp = req_lib.get(f"{args.base_url.replace('/v1', '')}/version", timeout=2) 
-        print(f"\n✓ Interceptor appears to be responding at {args.base_url}")
-        
+        await probe
+        print(f"\n✓ Interceptor appears to be responding at {tc.base_url}")
+
     except Exception as e:
         print(f"\n⚠ Warning: Could not verify interceptor is running.")
         print(f"  Error: {e}")
@@ -165,101 +354,46 @@ def run_all_tests():
         print("  python interceptor.py --trigger alias --verbose")
         print("  python interceptor.py --trigger any --verbose")
 
-    # Create client with custom base URL if provided
-    client = create_client(args.base_url)
+    # Absorb the model's cold start before the real cases, so they don't all
+    # queue behind the first one
+    if args.warmup:
+        try:
+            await warm_up(client)
+        except Exception as e:
+            print(f"\n⚠ Warning: Warm-up request failed: {e}")
 
-    # Run specific trigger mode tests if requested
+    # Every selected case is an independent request, so they run concurrently
     if args.test_trigger:
-        print(f"\n{'='*60}")
-        print(f"Running tests for --trigger {args.test_trigger} mode")
-        print(f"{'='*60}")
-        
-        if args.test_trigger == "alias":
-            # Test alias detection
-            test_alias_mode(client, args.alias_model)
-            
-        elif args.test_trigger == "prompt":
-            # Test prompt detection
-            test_mode(
-                client=client,
-                mode_name="Prompt Mode - Non-Thinking",
-                system_tag="/no_thinking",
-                user_query="What is 2+2?"
-            )
-            test_precise_mode(client)
-            
-        elif args.test_trigger in ("any", "all"):
-            # Test any mode: alias detection
-            test_alias_mode(client, args.alias_model)
-            # Test any mode: prompt override
-            test_alias_override(client)
-            # Test any mode: prompt only
-            test_mode(
-                client=client,
-                mode_name="Prompt Mode - Non-Thinking",
-                system_tag="/no_thinking",
-                user_query="What is 2+2?",
-                model_name="qwen3.5"
-            )
-    
-    elif args.streaming:
-        # Run streaming tests
-        test_streaming_mode(
-            client=client, 
-            mode_name="General Thinking (Streaming)", 
-            system_tag=None, 
-            user_query="Explain the concept of recursion in simple terms."
-        )
-
-        test_streaming_mode(
-            client=client, 
-            mode_name="Non-Thinking Fast Mode (Streaming)", 
-            system_tag="/no_thinking", 
-            user_query="What is 2 + 2?"
-        )
-
+        suite = "any" if args.test_trigger == "all" else args.test_trigger
     else:
-        # Run non-streaming tests (original test suite)
-        
-        # Test 1: General Thinking Mode (Default)
-        test_mode(
-            client=client, 
-            mode_name="General Thinking Mode (Default)", 
-            system_tag=None, 
-            user_query="Explain the concept of recursion in simple terms."
-        )
-
-        # Test 2: Non-Thinking Fast Mode - Simple Q&A should be quick and direct
-        test_mode(
-            client=client, 
-            mode_name="Non-Thinking Fast Mode", 
-            system_tag="/no_thinking", 
-            user_query="What is the capital of France?"
-        )
+        suite = "streaming" if args.streaming else "default"
+    cases = [case for case in _ALL_CASES if suite in case.suites]
 
-        # Test 3: Non-Thinking Fast Mode - Math question (should be direct)
-        test_mode(
-            client=client, 
-            mode_name="Non-Thinking Fast Mode (Math)", 
-            system_tag="/no_thinking", 
-            user_query="Calculate: 15 × 8 + 42 ÷ 7"
-        )
-
-        # Test 4: Precise Mode - Code generation should be accurate
-        test_precise_mode(client)
-
-        # Test 5: General Thinking with creative prompt (should show reasoning)
-        test_mode(
-            client=client, 
-            mode_name="General Thinking Mode (Creative)", 
-            system_tag=None, 
-            user_query="Design a simple algorithm to sort a list of numbers. Explain your approach."
+    try:
+        # Run specific trigger mode tests if requested
+        if args.test_trigger:
+            print(f"\n{'='*60}")
+            print(f"Running tests for --trigger {args.test_trigger} mode")
+            print(f"{'='*60}")
+
+        # Streaming cases are run one at a time straight to stdout, so the
+        # tokens are actually shown as they arrive
+        await run_concurrently(
+            [functools.partial(run_case, client, case, args.alias_model) for case in cases],
+            workers=1 if args.streaming else args.workers
         )
+    finally:
+        await tc.http.aclose()
 
     print("\n" + "="*60)
     print("Test suite completed!")
     print("="*60)
 
 
+def main():
+    args = _PARSER.parse_args()
+    asyncio.run(run_all_tests(args))
+
+
 if __name__ == "__main__":
-    run_all_tests()
+    main()